@@ -2,14 +2,17 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 import tempfile
+import shutil
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Load environment variables
 load_dotenv()
 
 # Import our RAG system
-from rag_system import CustomerSupportRAG
-from document_processor import DocumentProcessor
+from rag_system import CustomerSupportRAG, create_embeddings
+from document_processor import DocumentProcessor, process_file_worker
 from database import init_database, db_manager
 import json
 import hashlib
@@ -70,6 +73,15 @@ def initialize_database():
 # Initialize database
 db = initialize_database()
 
+# Shared across reruns and sessions instead of being rebuilt on every click
+@st.cache_resource
+def get_processor():
+    return DocumentProcessor()
+
+@st.cache_resource
+def get_embeddings():
+    return create_embeddings()
+
 # Initialize session state
 if 'rag_system' not in st.session_state:
     st.session_state.rag_system = None
@@ -143,7 +155,7 @@ def main():
         # Save settings to session state
         st.session_state.model = model
         st.session_state.temperature = temperature
-
+    
     # Main chat interface
     if not openai_key:
         st.warning("⚠️ Please enter your OpenAI API key in the sidebar to get started.")
@@ -216,7 +228,7 @@ def main():
         ask_button = st.form_submit_button("🚀 Ask", type="primary")
     
     if ask_button and question:
-        answer_question(question)
+        answer_question(question, chat_container)
     
     # Clear chat button
     if st.session_state.chat_history:
@@ -237,42 +249,110 @@ def process_documents(uploaded_files):
     
     with st.spinner("🔄 Processing documents... This may take a few minutes."):
         try:
-            # Initialize document processor
-            processor = DocumentProcessor()
+            # Get document processor
+            processor = get_processor()
+            
+            # Initialize RAG system on top of the persisted vector store
+            rag_system = CustomerSupportRAG(embeddings=get_embeddings())
             
-            # Process each uploaded file
-            all_documents = []
+            results = [None] * len(uploaded_files)
+            content_hashes = [None] * len(uploaded_files)
+            cached_count = 0
+            # Hashes already handled earlier in this upload
+            seen_hashes = set()
             progress_bar = st.progress(0)
+            completed = 0
             
-            for i, uploaded_file in enumerate(uploaded_files):
-                # Save uploaded file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    tmp_file_path = tmp_file.name
-                
-                # Process document
-                documents = processor.process_file(tmp_file_path, uploaded_file.name)
-                all_documents.extend(documents)
-                
-                # Clean up temp file
-                os.unlink(tmp_file_path)
+            tmp_file_paths = {}
+            try:
+                for i, uploaded_file in enumerate(uploaded_files):
+                    file_extension = Path(uploaded_file.name).suffix.lower()
+                    with uploaded_file.getbuffer() as buffer:
+                        content_hashes[i] = processor.hash_bytes(buffer)
+                    uploaded_file.seek(0)
+                    
+                    if content_hashes[i] in seen_hashes or rag_system.has_document(content_hashes[i]):
+                        # Already embedded in an earlier run or uploaded twice, reuse the stored chunks
+                        results[i] = []
+                        cached_count += 1
+                        
+                        completed += 1
+                        progress_bar.progress(completed / len(uploaded_files))
+                        continue
+                    
+                    seen_hashes.add(content_hashes[i])
+                    if file_extension == '.txt':
+                        # Plain text needs no extraction, decode it straight from the upload buffer
+                        with uploaded_file.getbuffer() as buffer:
+                            text = processor.decode_text(buffer)
+                        results[i] = processor.process_text(text, uploaded_file.name, file_extension)
+                        
+                        completed += 1
+                        progress_bar.progress(completed / len(uploaded_files))
+                    else:
+                        # Stream the upload to a temp file in 1 MB chunks instead of copying it in memory
+                        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
+                            tmp_file_paths[i] = tmp_file.name
+                            shutil.copyfileobj(uploaded_file, tmp_file, length=1024 * 1024)
                 
-                # Update progress
-                progress_bar.progress((i + 1) / len(uploaded_files))
+                # Process each remaining file in its own worker process. Workers are
+                # spawned rather than forked: forking from Streamlit's script thread
+                # would copy locks held by other threads into the children.
+                if tmp_file_paths:
+                    with ProcessPoolExecutor(
+                        max_workers=min(len(tmp_file_paths), os.cpu_count() or 1),
+                        mp_context=multiprocessing.get_context("spawn")
+                    ) as executor:
+                        futures = {
+                            executor.submit(process_file_worker, tmp_file_path, uploaded_files[i].name): i
+                            for i, tmp_file_path in tmp_file_paths.items()
+                        }
+                        
+                        for future in as_completed(futures):
+                            results[futures[future]] = future.result()
+                            
+                            # Update progress
+                            completed += 1
+                            progress_bar.progress(completed / len(uploaded_files))
+            finally:
+                # Clean up temp files
+                for tmp_file_path in tmp_file_paths.values():
+                    os.unlink(tmp_file_path)
             
-            # Initialize RAG system with processed documents
-            st.session_state.rag_system = CustomerSupportRAG()
-            st.session_state.rag_system.build_vector_store(all_documents)
+            # Tag chunks with their document hash so later uploads can reuse them
+            for documents, content_hash in zip(results, content_hashes):
+                for doc in documents:
+                    doc.metadata['content_hash'] = content_hash
+            
+            # Keep chunks in upload order regardless of completion order
+            all_documents = [doc for documents in results for doc in documents]
+            
+            # Add processed documents to the RAG system
+            rag_system.build_vector_store(all_documents)
+            st.session_state.rag_system = rag_system
             st.session_state.documents_loaded = True
             
-            st.success(f"✅ Successfully processed {len(uploaded_files)} documents!")
-            st.rerun()
+            # Record new documents so re-uploads skip extraction and embedding
+            try:
+                for uploaded_file, documents, content_hash in zip(uploaded_files, results, content_hashes):
+                    if documents:
+                        db_manager.save_document(
+                            name=uploaded_file.name,
+                            file_type=Path(uploaded_file.name).suffix.lower(),
+                            content_hash=content_hash,
+                            chunk_count=len(documents)
+                        )
+            except Exception as db_error:
+                st.warning(f"⚠️ Could not save document metadata: {str(db_error)}")
             
+            st.success(f"✅ Successfully processed {len(uploaded_files)} documents ({cached_count} reused from cache)!")
+            st.rerun()
+        
         except Exception as e:
             st.error(f"❌ Error processing documents: {str(e)}")
 
-def answer_question(question):
-    """Get answer from RAG system"""
+def answer_question(question, chat_container):
+    """Get answer from RAG system, streaming it into the chat"""
     
     if not st.session_state.rag_system:
         st.error("❌ Please process documents first!")
@@ -280,39 +360,56 @@ def answer_question(question):
     
     with st.spinner("🤔 Thinking..."):
         try:
-            # Get answer from RAG system
-            result = st.session_state.rag_system.ask_question(
+            # Retrieve context and start the answer stream
+            result = st.session_state.rag_system.stream_question(
                 question,
                 model=st.session_state.get('model', 'gpt-3.5-turbo'),
                 temperature=st.session_state.get('temperature', 0.1)
             )
-            
-            # Save conversation to database
-            try:
-                db_manager.save_conversation(
-                    session_id=st.session_state.session_id,
-                    question=question,
-                    answer=result['answer'],
-                    confidence_score=result.get('confidence', 0.0),
-                    source_documents=json.dumps(result['sources']) if result['sources'] else None,
-                    model_used=st.session_state.get('model', 'gpt-3.5-turbo'),
-                    temperature=st.session_state.get('temperature', 0.1)
-                )
-            except Exception as db_error:
-                st.warning(f"⚠️ Could not save to database: {str(db_error)}")
-            
-            # Add to chat history (for display)
-            st.session_state.chat_history.append((
-                question,
-                result['answer'],
-                result['sources']
-            ))
-            
-            # Refresh to show new conversation
-            st.rerun()
-            
         except Exception as e:
             st.error(f"❌ Error getting answer: {str(e)}")
+            return
+    
+    try:
+        # Render the new exchange below the existing history while tokens arrive
+        with chat_container:
+            st.markdown(f"""
+                <div class="chat-message user-message">
+                    <strong>You:</strong> {question}
+                </div>
+            """, unsafe_allow_html=True)
+            
+            st.markdown("**AI Assistant:**")
+            answer = st.write_stream(result['answer_stream'])
+            
+            if result['sources']:
+                with st.expander(f"📚 Sources for answer {len(st.session_state.chat_history) + 1}"):
+                    for j, source in enumerate(result['sources']):
+                        st.write(f"**Source {j+1}:** {source}")
+    except Exception as e:
+        st.error(f"❌ Error getting answer: {str(e)}")
+        return
+    
+    # Save conversation to database
+    try:
+        db_manager.save_conversation(
+            session_id=st.session_state.session_id,
+            question=question,
+            answer=answer,
+            confidence_score=result.get('confidence', 0.0),
+            source_documents=json.dumps(result['sources']) if result['sources'] else None,
+            model_used=st.session_state.get('model', 'gpt-3.5-turbo'),
+            temperature=st.session_state.get('temperature', 0.1)
+        )
+    except Exception as db_error:
+        st.warning(f"⚠️ Could not save to database: {str(db_error)}")
+    
+    # Add to chat history (for display on later reruns)
+    st.session_state.chat_history.append((
+        question,
+        answer,
+        result['sources']
+    ))
 
 if __name__ == "__main__":
     main()
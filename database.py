@@ -1,15 +1,32 @@
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import create_engine, func, inspect, text, update, Index, Column, Integer, String, Text, DateTime, Float, Boolean
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 
+logger = logging.getLogger(__name__)
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+# Every Streamlit session runs in its own thread, so keep enough pooled connections for concurrent users
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -22,29 +39,31 @@ class Document(Base):
     file_type = Column(String, nullable=False)
     content_hash = Column(String, unique=True, nullable=False)
     chunk_count = Column(Integer, nullable=False)
-    uploaded_at = Column(DateTime, default=datetime.utcnow)
+    uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     processed = Column(Boolean, default=False)
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    # Serves session history lookups ordered by time; also covers lookups by session_id alone
+    __table_args__ = (Index("ix_conv_session_created", "session_id", "created_at"),)
     
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, nullable=False, index=True)
+    session_id = Column(String, nullable=False)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     confidence_score = Column(Float, nullable=True)
     source_documents = Column(Text, nullable=True)  # JSON string
     model_used = Column(String, default="gpt-3.5-turbo")
     temperature = Column(Float, default=0.1)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String, unique=True, nullable=False, index=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    last_activity = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_activity = Column(DateTime(timezone=True), server_default=func.now())
     total_questions = Column(Integer, default=0)
 
 # Database operations class
@@ -53,9 +72,57 @@ class DatabaseManager:
         self.engine = engine
         self.SessionLocal = SessionLocal
         
+        # Conversations are written in batches instead of one transaction per question.
+        # Each queued row carries the number of failed attempts to write it.
+        self._conv_buffer: List[Tuple[Conversation, int]] = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_every = 25
+        self._flush_interval = 5.0
+        self._max_buffer = 1000
+        self._max_attempts = 3
+        
+        # Quiet sessions still get their rows written within _flush_interval
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+        atexit.register(self.flush)
+    
     def create_tables(self):
         """Create all database tables"""
         Base.metadata.create_all(bind=self.engine)
+        
+        # create_all skips tables that already exist, so indexes added since
+        # the tables were first created have to be created separately
+        for index in Conversation.__table__.indexes:
+            index.create(bind=self.engine, checkfirst=True)
+        
+        self._migrate_timestamps()
+    
+    def _migrate_timestamps(self):
+        """Convert timestamp columns of tables created by older versions
+        
+        Those were naive UTC timestamps filled in by Python, without a database
+        default. Only PostgreSQL tables are migrated.
+        """
+        if self.engine.dialect.name != "postgresql":
+            return
+        
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if not isinstance(column.type, DateTime) or column.name not in existing:
+                        continue
+                    
+                    if not getattr(existing[column.name]["type"], "timezone", False):
+                        connection.execute(text(
+                            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                            f"TYPE TIMESTAMP WITH TIME ZONE USING {column.name} AT TIME ZONE 'UTC'"
+                        ))
+                    if existing[column.name]["default"] is None:
+                        connection.execute(text(
+                            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT now()"
+                        ))
     
     def get_session(self) -> Session:
         """Get a database session"""
@@ -96,7 +163,7 @@ class DatabaseManager:
                 db.refresh(session)
             else:
                 # Update last activity
-                session.last_activity = datetime.utcnow()
+                session.last_activity = func.now()
                 db.commit()
             return session
         finally:
@@ -105,45 +172,120 @@ class DatabaseManager:
     def save_conversation(self, session_id: str, question: str, answer: str, 
                          confidence_score: float = None, source_documents: str = None,
                          model_used: str = "gpt-3.5-turbo", temperature: float = 0.1) -> Conversation:
-        """Save a conversation exchange to database"""
-        db = self.get_session()
-        try:
-            # Ensure session exists
-            self.get_or_create_session(session_id)
+        """Queue a conversation exchange, writing queued exchanges in batches"""
+        conversation = Conversation(
+            session_id=session_id,
+            question=question,
+            answer=answer,
+            confidence_score=confidence_score,
+            source_documents=source_documents,
+            model_used=model_used,
+            temperature=temperature,
+            # Queued rows are inserted later, so record when the question was actually asked
+            created_at=datetime.now(timezone.utc)
+        )
+        
+        with self._buffer_lock:
+            self._conv_buffer.append((conversation, 0))
+            should_flush = len(self._conv_buffer) >= self._flush_every
+        
+        if should_flush:
+            self.flush()
+        return conversation
+    
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self._flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Write queued conversations and session counters in a single transaction
+        
+        Never raises: rows that fail are queued again for the next flush, and
+        dropped (with an error logged) after _max_attempts failed writes.
+        """
+        # One flush at a time, so the timer and a full buffer don't race on session rows
+        with self._flush_lock:
+            with self._buffer_lock:
+                queued, self._conv_buffer = self._conv_buffer, []
             
-            conversation = Conversation(
-                session_id=session_id,
-                question=question,
-                answer=answer,
-                confidence_score=confidence_score,
-                source_documents=source_documents,
-                model_used=model_used,
-                temperature=temperature
-            )
-            db.add(conversation)
+            if not queued:
+                return
             
-            # Update session question count
-            session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-            if session:
-                session.total_questions += 1
-                session.last_activity = datetime.utcnow()
+            try:
+                self._write_conversations([conversation for conversation, _ in queued])
+            except Exception:
+                logger.exception("Could not save %d conversations", len(queued))
+                self._requeue(queued)
+    
+    def _write_conversations(self, conversations: List[Conversation]):
+        question_counts = Counter(conversation.session_id for conversation in conversations)
+        db = self.get_session()
+        try:
+            for session_id, count in question_counts.items():
+                self._bump_session(db, session_id, count)
             
+            db.bulk_save_objects(conversations)
             db.commit()
-            db.refresh(conversation)
-            return conversation
+        except Exception:
+            db.rollback()
+            raise
         finally:
             db.close()
     
+    @staticmethod
+    def _bump_session(db: Session, session_id: str, count: int):
+        """Add to a session's question count, creating the session row if needed"""
+        bump = (
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id)
+            .values(total_questions=ChatSession.total_questions + count,
+                    last_activity=func.now())
+            .returning(ChatSession.id)
+        )
+        
+        # RETURNING tells us whether the session already exists
+        if db.execute(bump).first() is not None:
+            return
+        
+        try:
+            # Savepoint, so losing an insert race doesn't abort the whole batch
+            with db.begin_nested():
+                db.add(ChatSession(session_id=session_id, total_questions=count))
+        except IntegrityError:
+            # Another process created the session first, count on top of its row
+            db.execute(bump)
+    
+    def _requeue(self, queued: List[Tuple[Conversation, int]]):
+        """Put rows from a failed flush back in front of the queue"""
+        retry = [(conversation, attempts + 1) for conversation, attempts in queued
+                 if attempts + 1 < self._max_attempts]
+        dropped = len(queued) - len(retry)
+        
+        with self._buffer_lock:
+            self._conv_buffer[:0] = retry
+            # Bound memory while the database is unreachable, dropping the oldest rows
+            overflow = len(self._conv_buffer) - self._max_buffer
+            if overflow > 0:
+                del self._conv_buffer[:overflow]
+                dropped += overflow
+        
+        if dropped:
+            logger.error("Dropped %d conversations that could not be saved", dropped)
+    
     def get_conversation_history(self, session_id: str, limit: int = 50) -> List[Conversation]:
-        """Get conversation history for a session"""
+        """Get the latest conversations for a session"""
+        self.flush()
         db = self.get_session()
         try:
+            # Backward scan of (session_id, created_at) reads only the latest rows
             conversations = db.query(Conversation)\
                 .filter(Conversation.session_id == session_id)\
                 .order_by(Conversation.created_at.desc())\
                 .limit(limit)\
                 .all()
-            return list(reversed(conversations))  # Return in chronological order
+            conversations.reverse()  # Return in chronological order
+            return conversations
         finally:
             db.close()
     
@@ -157,6 +299,7 @@ class DatabaseManager:
     
     def get_session_stats(self, session_id: str) -> Dict[str, Any]:
         """Get statistics for a session"""
+        self.flush()
         db = self.get_session()
         try:
             session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
@@ -173,19 +316,24 @@ class DatabaseManager:
     
     def clear_session_history(self, session_id: str):
         """Clear conversation history for a session"""
-        db = self.get_session()
-        try:
-            db.query(Conversation).filter(Conversation.session_id == session_id).delete()
-            
-            # Reset session stats
-            session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-            if session:
-                session.total_questions = 0
-                session.last_activity = datetime.utcnow()
+        # Hold off flushes: one in progress could write or requeue the session's rows after the delete
+        with self._flush_lock:
+            with self._buffer_lock:
+                self._conv_buffer = [queued for queued in self._conv_buffer if queued[0].session_id != session_id]
             
-            db.commit()
-        finally:
-            db.close()
+            db = self.get_session()
+            try:
+                db.query(Conversation).filter(Conversation.session_id == session_id).delete()
+                
+                # Reset session stats
+                session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+                if session:
+                    session.total_questions = 0
+                    session.last_activity = func.now()
+                
+                db.commit()
+            finally:
+                db.close()
 
 # Global database manager instance
 db_manager = DatabaseManager()
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from rag_system import CustomerSupportRAG, EMBEDDING_BACKEND
+from document_processor import DocumentProcessor, process_file_worker
+from database import init_database, db_manager
+
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
+
+def collect_files(paths):
+    """Expand the given files and directories into supported document paths"""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob('*') if p.suffix.lower() in SUPPORTED_EXTENSIONS))
+        elif path.suffix.lower() in SUPPORTED_EXTENSIONS:
+            files.append(path)
+        else:
+            print(f"Skipping unsupported file: {path}")
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-load documents into the knowledge base, embedding them through the OpenAI Batch API. "
+                    "Costs half as much as uploading through the app, but can take up to 24 hours."
+    )
+    parser.add_argument("paths", nargs="+", help="PDF, DOCX or TXT files, or directories to search for them")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch status checks")
+    args = parser.parse_args()
+    
+    # Fail before spending time on extraction
+    if EMBEDDING_BACKEND != "openai":
+        parser.error("the Batch API is only available with the OpenAI embedding backend (EMBEDDING_BACKEND=openai)")
+    
+    files = collect_files(args.paths)
+    processor = DocumentProcessor()
+    rag_system = CustomerSupportRAG()
+    init_database()
+    
+    new_files = {}
+    seen_hashes = set()
+    for file_path in files:
+        content_hash = processor.hash_bytes(file_path.read_bytes())
+        if content_hash in seen_hashes or rag_system.has_document(content_hash):
+            print(f"Already in the knowledge base: {file_path}")
+            continue
+        seen_hashes.add(content_hash)
+        new_files[file_path] = content_hash
+    
+    if not new_files:
+        print("No new documents to ingest.")
+        return
+    
+    # Extract and chunk in worker processes, as the app does
+    with ProcessPoolExecutor(
+        max_workers=min(len(new_files), os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = list(executor.map(process_file_worker, map(str, new_files), [path.name for path in new_files]))
+    
+    # Tag chunks with their document hash so later uploads can reuse them
+    for documents, content_hash in zip(results, new_files.values()):
+        for doc in documents:
+            doc.metadata['content_hash'] = content_hash
+    
+    all_documents = [doc for documents in results for doc in documents]
+    print(f"Embedding {len(all_documents)} chunks from {len(new_files)} documents through the Batch API...")
+    asyncio.run(rag_system.build_vector_store_batch(all_documents, poll_interval=args.poll_interval))
+    
+    # Record new documents so uploads through the app skip them
+    try:
+        for (file_path, content_hash), documents in zip(new_files.items(), results):
+            if documents:
+                db_manager.save_document(
+                    name=file_path.name,
+                    file_type=file_path.suffix.lower(),
+                    content_hash=content_hash,
+                    chunk_count=len(documents)
+                )
+    except Exception as db_error:
+        print(f"Could not save document metadata: {db_error}")
+    
+    print(f"Ingested {len(new_files)} documents.")
+
+if __name__ == "__main__":
+    main()
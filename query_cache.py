@@ -0,0 +1,218 @@
+import os
+import atexit
+import pickle
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+# Seconds between writes of a changed cache to disk
+SAVE_INTERVAL = 60.0
+
+_caches: Dict[str, "QueryCache"] = {}
+_caches_lock = threading.Lock()
+
+def get_query_cache(path: str) -> "QueryCache":
+    """Get the process-wide cache persisted at path, so all sessions share one copy"""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = QueryCache(path)
+        return _caches[path]
+
+class QueryCache:
+    """Cache of retrieved documents keyed by exact question and by query embedding similarity
+    
+    Thread-safe. Changes are written to disk every SAVE_INTERVAL seconds and at exit.
+    """
+    
+    def __init__(self, path: str, max_size: int = 512, threshold: float = 0.97):
+        self.path = path
+        self.max_size = max_size
+        self.threshold = threshold
+        # Bumped by clear() whenever the vector store changes
+        self.generation = 0
+        # Version of the vector store the entries were retrieved from, see sync_version()
+        self._version = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._reset()
+        self._load()
+        
+        threading.Thread(target=self._save_periodically, daemon=True).start()
+        atexit.register(self.save)
+    
+    def clear(self):
+        """Drop all cached entries and invalidate retrievals still in flight"""
+        with self._lock:
+            self._clear()
+    
+    def sync_version(self, version):
+        """Drop all entries if the vector store changed since they were cached
+        
+        Catches additions this process wasn't told about: documents ingested by
+        another process, or a cache file saved before the last ingest.
+        """
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+    
+    def _clear(self):
+        self.generation += 1
+        self._reset()
+        self._dirty = True
+    
+    def _reset(self):
+        # Entries live in a ring buffer of slots, the oldest slot is overwritten first
+        self._questions: List[Optional[str]] = [None] * self.max_size
+        self._documents: List[Optional[List[Document]]] = [None] * self.max_size
+        self._slots = {}
+        self._embeddings: Optional[np.ndarray] = None
+        self._size = 0
+        self._next = 0
+    
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Normalize case and whitespace so trivially different questions share an entry"""
+        return " ".join(question.lower().split())
+    
+    def get_exact(self, question: str) -> Optional[List[Document]]:
+        """Get documents cached for the same question"""
+        with self._lock:
+            slot = self._slots.get(self.normalize_question(question))
+            return None if slot is None else self._documents[slot]
+    
+    def get_similar(self, embedding: List[float]) -> Optional[List[Document]]:
+        """Get documents cached for the most similar question above the threshold"""
+        query = self._normalize_embedding(embedding)
+        
+        with self._lock:
+            if not self._size or query.shape[0] != self._embeddings.shape[1]:
+                return None
+            
+            scores = self._embeddings[:self._size] @ query
+            best = int(np.argmax(scores))
+            return self._documents[best] if scores[best] >= self.threshold else None
+    
+    def put(self, question: str, embedding: List[float], documents: List[Document], generation: int):
+        """Cache documents retrieved for a question
+        
+        generation is the value read before retrieving. If the vector store changed
+        since, the documents may be stale and are not cached.
+        """
+        key = self.normalize_question(question)
+        vector = self._normalize_embedding(embedding)
+        
+        with self._lock:
+            if generation == self.generation:
+                self._put(key, vector, documents)
+    
+    def _put(self, key: str, vector: np.ndarray, documents: List[Document]):
+        if self._embeddings is None or self._embeddings.shape[1] != vector.shape[0]:
+            self._reset()
+            self._embeddings = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+        
+        slot = self._slots.get(key)
+        if slot is None:
+            # FIFO eviction: reuse the oldest slot
+            slot = self._next
+            self._next = (self._next + 1) % self.max_size
+            self._size = min(self._size + 1, self.max_size)
+            if self._questions[slot] is not None:
+                del self._slots[self._questions[slot]]
+        
+        self._questions[slot] = key
+        self._documents[slot] = documents
+        self._embeddings[slot] = vector
+        self._slots[key] = slot
+        self._dirty = True
+    
+    @staticmethod
+    def _normalize_embedding(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _load(self):
+        """Load a cache persisted by an earlier session"""
+        try:
+            with open(self.path, 'rb') as file:
+                state = pickle.load(file)
+        except Exception:
+            # A missing or unreadable cache file just means starting empty
+            return
+        
+        if len(state['questions']) != self.max_size:
+            return
+        
+        self._questions = state['questions']
+        self._documents = state['documents']
+        self._slots = state['slots']
+        self._embeddings = state['embeddings']
+        self._size = state['size']
+        self._next = state['next']
+        self._version = state.get('version')
+    
+    def _save_periodically(self):
+        while True:
+            time.sleep(SAVE_INTERVAL)
+            try:
+                self.save()
+            except OSError:
+                # Try again on the next round
+                pass
+    
+    def save(self):
+        """Persist the cache if it changed, replacing the file atomically"""
+        with self._lock:
+            if not self._dirty:
+                return
+            
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp_file:
+                pickle.dump({
+                    'questions': self._questions,
+                    'documents': self._documents,
+                    'slots': self._slots,
+                    'embeddings': self._embeddings,
+                    'size': self._size,
+                    'next': self._next,
+                    'version': self._version
+                }, tmp_file)
+            os.replace(tmp_file.name, self.path)
+            self._dirty = False
+
+class CachedRetriever(BaseRetriever):
+    """Vector store retriever that reuses results for repeated or near-duplicate questions"""
+    
+    vector_store: VectorStore
+    cache: QueryCache
+    k: int = 3
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                k: Optional[int] = None) -> List[Document]:
+        k = k or self.k
+        generation = self.cache.generation
+        
+        # Exact repeat: no embedding call at all. Results are ranked, so a
+        # cached list with at least k documents also answers smaller k.
+        documents = self.cache.get_exact(query)
+        if documents is not None and len(documents) >= k:
+            return documents[:k]
+        
+        # Near-duplicate: one embedding call, no vector search
+        embedding = self.vector_store.embeddings.embed_query(query)
+        documents = self.cache.get_similar(embedding)
+        if documents is not None and len(documents) >= k:
+            return documents[:k]
+        
+        # Miss: search with the embedding we already have
+        documents = self.vector_store.similarity_search_by_vector(embedding, k=k)
+        self.cache.put(query, embedding, documents, generation)
+        return documents
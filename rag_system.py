@@ -1,42 +1,473 @@
 import os
-from typing import List, Dict, Any
-from langchain_community.vectorstores import Chroma
+import asyncio
+import json
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple
+import numpy as np
+import openai
+from chromadb.utils.batch_utils import create_batches
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import Chroma, FAISS
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
 from langchain.memory import ConversationBufferMemory
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
+from langchain_core.vectorstores import VectorStore
+from query_cache import CachedRetriever, QueryCache, get_query_cache
+from database import db_manager
+
+PERSIST_DIRECTORY = "./chroma_db"
+
+# Embedding backend: "openai", "infinity" (local Infinity server) or "huggingface" (in-process)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+
+# Vectors from different backends have different dimensions, so each gets its own collection
+COLLECTION_NAME = "langchain" if EMBEDDING_BACKEND == "openai" else f"langchain_{EMBEDDING_BACKEND}"
+
+# Vector store backend: "chroma" or "faiss"
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+FAISS_DIRECTORY = os.path.join(PERSIST_DIRECTORY, f"faiss_{COLLECTION_NAME}")
+
+# FAISS index layout: HNSW for small corpora (8-bit vectors once there are enough
+# to train the quantizer ranges), IVF-PQ once the corpus is large enough that
+# vectors dominate memory
+FAISS_HNSW_NEIGHBORS = 32
+FAISS_SQ_MIN_VECTORS = 1_000
+FAISS_IVFPQ_MIN_VECTORS = 100_000
+FAISS_IVF_LISTS = 1024
+FAISS_IVF_PROBES = 16
+FAISS_PQ_SUBQUANTIZERS = 16
+FAISS_PQ_BITS = 8
+
+# Texts per embeddings request and number of requests kept in flight. Concurrency
+# hides network latency; an in-process model would only have its calls compete
+# for the same cores, so it gets a single call.
+EMBED_BATCH_SIZE = 256
+EMBED_CONCURRENCY = 1 if EMBEDDING_BACKEND == "huggingface" else 8
+
+# Batch API jobs that have stopped running
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Most embedding inputs the Batch API accepts in a single job
+BATCH_MAX_INPUTS = 50_000
+
+# Words that suggest the answer spans several chunks
+BROAD_QUESTION_KEYWORDS = {"list", "compare", "comparison", "steps", "difference", "differences", "options", "all"}
+
+def create_embeddings() -> Embeddings:
+    """Create the embeddings client for the configured backend"""
+    
+    if EMBEDDING_BACKEND == "openai":
+        return OpenAIEmbeddings()
+    
+    if EMBEDDING_BACKEND == "infinity":
+        from langchain_community.embeddings import InfinityEmbeddings
+        return InfinityEmbeddings(
+            model=os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"),
+            infinity_api_url=os.getenv("INFINITY_API_URL", "http://localhost:7997")
+        )
+    
+    if EMBEDDING_BACKEND == "huggingface":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            encode_kwargs={"batch_size": 128, "normalize_embeddings": True}
+        )
+    
+    raise ValueError(f"Unsupported embedding backend: {EMBEDDING_BACKEND}")
+
+def faiss_layout_for(n: int, dimension: int) -> str:
+    """Index layout suited to a corpus of n vectors ("ivfpq", "hnsw_sq" or "hnsw")"""
+    if n >= FAISS_IVFPQ_MIN_VECTORS and dimension % FAISS_PQ_SUBQUANTIZERS == 0:
+        return "ivfpq"
+    if n >= FAISS_SQ_MIN_VECTORS:
+        return "hnsw_sq"
+    return "hnsw"
+
+def faiss_layout_of(index) -> str:
+    """Layout of an existing FAISS index, as named by faiss_layout_for"""
+    import faiss
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexHNSWSQ):
+        return "hnsw_sq"
+    return "hnsw"
+
+def build_faiss_index(vectors: np.ndarray):
+    """Build an empty FAISS index suited to the corpus, training it on the given vectors"""
+    import faiss
+    
+    n, dimension = vectors.shape
+    
+    if faiss_layout_for(n, dimension) == "ivfpq":
+        # Product quantization stores each vector in a few bytes instead of 4 bytes per dimension
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatL2(dimension), dimension,
+            FAISS_IVF_LISTS, FAISS_PQ_SUBQUANTIZERS, FAISS_PQ_BITS
+        )
+        index.train(vectors)
+        index.nprobe = FAISS_IVF_PROBES
+        return index
+    
+    if faiss_layout_for(n, dimension) == "hnsw_sq":
+        # int8 per dimension: a quarter of the float32 footprint for a small recall loss
+        index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, FAISS_HNSW_NEIGHBORS)
+        index.train(vectors)
+        return index
+    
+    return faiss.IndexHNSWFlat(dimension, FAISS_HNSW_NEIGHBORS)
+
+class SharedFAISS(FAISS):
+    """FAISS store shared by all sessions of the process
+    
+    FAISS indexes can't be searched while vectors are being added, so adds and
+    searches take the same lock. Also tracks the content hashes of stored
+    documents, so duplicate checks don't scan the docstore.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+        # Saved copy this store matches (None if never saved or loaded), see sync()
+        self.version: Optional[int] = None
+        self._index_content_hashes()
+    
+    def _index_content_hashes(self):
+        self.content_hashes = {
+            doc.metadata["content_hash"]
+            for doc in self.docstore._dict.values()
+            if "content_hash" in doc.metadata
+        }
+    
+    @staticmethod
+    def saved_version(folder_path: str) -> Optional[int]:
+        """Version of the store saved in folder_path, None if there is none
+        
+        save_local writes index.pkl after index.faiss, so its mtime marks a complete save.
+        """
+        try:
+            return os.stat(os.path.join(folder_path, "index.pkl")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    @classmethod
+    def load(cls, folder_path: str, embeddings: Embeddings) -> Optional["SharedFAISS"]:
+        """Load the store saved in folder_path, None if there is none"""
+        version = cls.saved_version(folder_path)
+        if version is None:
+            return None
+        
+        # Vectors are L2-normalized so L2 ranking matches cosine similarity
+        store = cls.load_local(folder_path, embeddings, normalize_L2=True)
+        store.version = version
+        return store
+    
+    def sync(self, folder_path: str):
+        """Reload the store in place if another process (e.g. ingest.py) saved a newer copy"""
+        with self.lock:
+            version = self.saved_version(folder_path)
+            if version is None or version == self.version:
+                return
+            
+            saved = FAISS.load_local(folder_path, self.embeddings, normalize_L2=True)
+            self.index = saved.index
+            self.docstore = saved.docstore
+            self.index_to_docstore_id = saved.index_to_docstore_id
+            self._index_content_hashes()
+            self.version = version
+    
+    def save(self, folder_path: str):
+        """Persist the store, remembering which saved copy it matches"""
+        with self.lock:
+            self.save_local(folder_path)
+            self.version = self.saved_version(folder_path)
+    
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> List[str]:
+        with self.lock:
+            ids = super().add_embeddings(text_embeddings, metadatas=metadatas, ids=ids, **kwargs)
+            self.content_hashes.update(
+                metadata["content_hash"] for metadata in metadatas or [] if "content_hash" in metadata
+            )
+            return ids
+    
+    def similarity_search_with_score_by_vector(self, *args, **kwargs) -> List[Tuple[Document, float]]:
+        with self.lock:
+            return super().similarity_search_with_score_by_vector(*args, **kwargs)
+
+# The FAISS store lives in memory, one copy per process
+_faiss_store: Optional[SharedFAISS] = None
+_faiss_store_lock = threading.Lock()
 
 class CustomerSupportRAG:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
+    def __init__(self, embeddings: Optional[Embeddings] = None):
+        # Accept a shared embeddings client so it isn't rebuilt for every instance
+        self.embeddings = embeddings or create_embeddings()
         self.vector_store = None
-        self.qa_chain = None
+        self.retriever = None
+        self.prompt = None
+        self._llm_cache: Dict[Tuple[str, float], ChatOpenAI] = {}
+        # Runs speculative retrieval while a follow-up question is being condensed
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # One cache per collection for the whole process, shared by all sessions
+        self.query_cache = get_query_cache(os.path.join(PERSIST_DIRECTORY, f"query_cache_{COLLECTION_NAME}.pkl"))
+        # Document names, loaded on first use and then kept up to date on insert
+        self._known_sources: Optional[Set[str]] = None
         self.memory = ConversationBufferMemory(
             memory_key="chat_history",
             return_messages=True,
             output_key="answer"
         )
-        
+    
     def build_vector_store(self, documents: List[Document]):
-        """Build vector store from documents"""
+        """Build vector store from documents, adding them to the persisted store"""
         
-        # Create Chroma vector store
-        self.vector_store = Chroma.from_documents(
-            documents=documents,
-            embedding=self.embeddings,
-            persist_directory="./chroma_db"
-        )
+        self._get_vector_store()
+        
+        if documents:
+            # Embed all batches concurrently instead of one round-trip at a time
+            embeddings = self._embed_texts([doc.page_content for doc in documents])
+            self._add_embedded_documents(documents, embeddings)
+        
+        if self.vector_store is None:
+            raise ValueError("No documents to build the vector store from.")
         
         # Create retrieval QA chain
         self._setup_qa_chain()
     
-    def _setup_qa_chain(self, model: str = "gpt-3.5-turbo", temperature: float = 0.1):
-        """Setup the QA chain with custom prompt and specified model"""
-        return self._setup_qa_chain_with_model(model, temperature)
+    async def build_vector_store_batch(self, documents: List[Document], poll_interval: float = 60.0):
+        """Build vector store from documents, embedding them through the OpenAI Batch API
+        
+        Costs half as much as synchronous embedding requests and has its own rate limits,
+        but results can take up to 24 hours. Meant for offline bulk ingestion.
+        """
+        
+        if EMBEDDING_BACKEND != "openai":
+            raise ValueError("The Batch API is only available with the OpenAI embedding backend.")
+        
+        self._get_vector_store()
+        
+        if documents:
+            texts = [doc.page_content for doc in documents]
+            batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+            client = openai.AsyncOpenAI()
+            
+            # Large corpora are spread over several jobs that run side by side
+            batches_per_job = BATCH_MAX_INPUTS // EMBED_BATCH_SIZE
+            results = await asyncio.gather(*[
+                self._run_embedding_batch(client, batches[i:i + batches_per_job], poll_interval)
+                for i in range(0, len(batches), batches_per_job)
+            ])
+            
+            embeddings = [embedding for job_embeddings in results for embedding in job_embeddings]
+            self._add_embedded_documents(documents, embeddings)
+        
+        if self.vector_store is None:
+            raise ValueError("No documents to build the vector store from.")
+        
+        # Create retrieval QA chain
+        self._setup_qa_chain()
     
-    def _setup_qa_chain_with_model(self, model: str = "gpt-3.5-turbo", temperature: float = 0.1):
-        """Setup the QA chain with custom prompt"""
+    async def _run_embedding_batch(self, client: openai.AsyncOpenAI, batches: List[List[str]],
+                                   poll_interval: float) -> List[List[float]]:
+        """Embed batches of texts in one Batch API job and wait for the results"""
+        
+        # One embeddings request per batch of texts, using the model queries are embedded with
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as requests_file:
+            for i, batch in enumerate(batches):
+                request = {
+                    "custom_id": str(i),
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {"model": self.embeddings.model, "input": batch}
+                }
+                requests_file.write(json.dumps(request) + "\n")
+        
+        try:
+            with open(requests_file.name, 'rb') as file:
+                input_file = await client.files.create(file=file, purpose="batch")
+        finally:
+            os.unlink(requests_file.name)
+        
+        job = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h"
+        )
+        while job.status not in BATCH_FINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            job = await client.batches.retrieve(job.id)
+        
+        if job.status != "completed" or not job.output_file_id:
+            raise RuntimeError(f"Embedding batch {job.id} ended with status '{job.status}'")
+        
+        # Output lines can come back in any order
+        output = await client.files.content(job.output_file_id)
+        results = {}
+        for line in output.text.splitlines():
+            record = json.loads(line)
+            if record.get("error") or record["response"]["status_code"] != 200:
+                raise RuntimeError(f"Embedding request {record['custom_id']} in batch {job.id} failed")
+            data = sorted(record["response"]["body"]["data"], key=lambda item: item["index"])
+            results[int(record["custom_id"])] = [item["embedding"] for item in data]
+        
+        if len(results) != len(batches):
+            raise RuntimeError(f"Embedding batch {job.id} returned {len(results)} of {len(batches)} results")
+        
+        return [embedding for i in range(len(batches)) for embedding in results[i]]
+    
+    def _add_embedded_documents(self, documents: List[Document], embeddings: List[List[float]]):
+        """Add documents with precomputed vectors to the vector store"""
+        
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        
+        if VECTOR_STORE_BACKEND == "faiss":
+            self._add_to_faiss(texts, embeddings, metadatas)
+        else:
+            # Chroma rejects adds above the SQLite variable limit, so add in batches it accepts
+            for batch_ids, batch_embeddings, batch_metadatas, batch_texts in create_batches(
+                api=self.vector_store._client,
+                ids=[str(uuid.uuid4()) for _ in texts],
+                embeddings=embeddings,
+                metadatas=metadatas,
+                documents=texts
+            ):
+                self.vector_store._collection.add(
+                    ids=batch_ids,
+                    embeddings=batch_embeddings,
+                    documents=batch_texts,
+                    metadatas=batch_metadatas
+                )
+        
+        # Cached retrievals may no longer be the best matches
+        self.query_cache.clear()
+        
+        if self._known_sources is not None:
+            self._known_sources.update(metadata['source'] for metadata in metadatas if 'source' in metadata)
+    
+    def _get_vector_store(self) -> Optional[VectorStore]:
+        """Open the persisted vector store (None if a FAISS store was never saved)"""
+        global _faiss_store
+        if self.vector_store is None:
+            if VECTOR_STORE_BACKEND == "faiss":
+                with _faiss_store_lock:
+                    if _faiss_store is None:
+                        _faiss_store = SharedFAISS.load(FAISS_DIRECTORY, self.embeddings)
+                    self.vector_store = _faiss_store
+                return self.vector_store
+            
+            self.vector_store = Chroma(
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.embeddings,
+                persist_directory=PERSIST_DIRECTORY
+            )
+        return self.vector_store
+    
+    def has_document(self, content_hash: str) -> bool:
+        """Check whether chunks of a document are already in the vector store"""
+        vector_store = self._get_vector_store()
+        
+        if vector_store is None:
+            return False
+        
+        if VECTOR_STORE_BACKEND == "faiss":
+            vector_store.sync(FAISS_DIRECTORY)
+            return content_hash in vector_store.content_hashes
+        
+        # Chroma answers this from its SQLite metadata index
+        results = vector_store._collection.get(
+            where={"content_hash": content_hash},
+            limit=1,
+            include=[]
+        )
+        return bool(results['ids'])
+    
+    def _add_to_faiss(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]):
+        """Add precomputed vectors to the FAISS store, creating and persisting it as needed"""
+        
+        global _faiss_store
+        with _faiss_store_lock:
+            # Another session or process may have created the store since this one last looked
+            if _faiss_store is None:
+                _faiss_store = SharedFAISS.load(FAISS_DIRECTORY, self.embeddings)
+            if _faiss_store is None:
+                _faiss_store = SharedFAISS(
+                    embedding_function=self.embeddings,
+                    index=build_faiss_index(self._normalize_vectors(embeddings)),
+                    docstore=InMemoryDocstore(),
+                    index_to_docstore_id={},
+                    normalize_L2=True
+                )
+            self.vector_store = _faiss_store
+        
+        # Hold the lock until saved so concurrent adds don't interleave their writes.
+        # Pick up anything saved by another process first, or the save would drop it.
+        with self.vector_store.lock:
+            self.vector_store.sync(FAISS_DIRECTORY)
+            self._rebuild_faiss_index_if_outgrown(embeddings)
+            self.vector_store.add_embeddings(zip(texts, embeddings), metadatas=metadatas)
+            self.vector_store.save(FAISS_DIRECTORY)
+    
+    def _rebuild_faiss_index_if_outgrown(self, embeddings: List[List[float]]):
+        """Move the stored vectors to a new index once the store grows past a layout threshold
+        
+        The layout is picked from the vectors available when an index is built, and
+        a store is usually started by a small upload. Vectors are positioned as
+        before, so the docstore mapping stays valid.
+        """
+        index = self.vector_store.index
+        if faiss_layout_for(index.ntotal + len(embeddings), index.d) == faiss_layout_of(index):
+            return
+        
+        stored = index.reconstruct_n(0, index.ntotal)
+        rebuilt = build_faiss_index(np.vstack([stored, self._normalize_vectors(embeddings)]))
+        rebuilt.add(stored)
+        self.vector_store.index = rebuilt
+    
+    @staticmethod
+    def _normalize_vectors(embeddings: List[List[float]]) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+    
+    def _store_version(self):
+        """Value that changes whenever any process adds to the vector store"""
+        if VECTOR_STORE_BACKEND == "faiss":
+            self.vector_store.sync(FAISS_DIRECTORY)
+            return self.vector_store.version
+        return self.vector_store._collection.count()
+    
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches, keeping several requests in flight
+        
+        Uses threads around the synchronous client: the embeddings client is shared
+        across sessions, and its async client would stay bound to the event loop of
+        the first asyncio.run call after that loop is closed.
+        """
+        
+        if EMBED_CONCURRENCY == 1:
+            # The client batches internally
+            return self.embeddings.embed_documents(texts)
+        
+        def _embed_batch(batch: List[str]) -> List[List[float]]:
+            # Small jitter so the first wave doesn't hit the rate limiter at once
+            time.sleep(random.uniform(0, 0.05))
+            return self.embeddings.embed_documents(batch)
+        
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+            results = list(executor.map(_embed_batch, batches))
+        
+        return [embedding for batch in results for embedding in batch]
+    
+    def _setup_qa_chain(self):
+        """Setup the retriever and custom prompt used to answer questions"""
         
         # Custom prompt template for customer support
         prompt_template = """You are a helpful AI customer support assistant. Use the following context to answer the customer's question. If you cannot find the answer in the context, politely say so and suggest contacting human support.
@@ -59,42 +490,125 @@ Answer:"""
             input_variables=["context", "question"]
         )
         
-        # Create the chain with specified model
-        self.qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(temperature=temperature, model_name=model),
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 3}),
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": prompt}
-        )
+        self.prompt = prompt
+        self.retriever = CachedRetriever(vector_store=self.vector_store, cache=self.query_cache, k=3)
+    
+    def _get_llm(self, model: str, temperature: float) -> ChatOpenAI:
+        """Get a chat model, reusing the instance (and its HTTP connection pool) per settings"""
+        key = (model, temperature)
+        if key not in self._llm_cache:
+            self._llm_cache[key] = ChatOpenAI(temperature=temperature, model_name=model)
+        return self._llm_cache[key]
     
     def ask_question(self, question: str, model: str = "gpt-3.5-turbo", temperature: float = 0.1) -> Dict[str, Any]:
         """Ask a question and get an answer with sources"""
         
-        if not self.qa_chain:
+        llm, prompt, source_documents = self._prepare_answer(question, model, temperature)
+        
+        # Get answer
+        answer = llm.invoke(prompt).content
+        self.memory.save_context({"question": question}, {"answer": answer})
+        result = {'answer': answer, 'source_documents': source_documents}
+        
+        return {
+            'answer': result['answer'],
+            'sources': self._format_sources(source_documents),
+            'confidence': self._calculate_confidence(result)
+        }
+    
+    def stream_question(self, question: str, model: str = "gpt-3.5-turbo", temperature: float = 0.1) -> Dict[str, Any]:
+        """Ask a question and get a stream of answer tokens with sources"""
+        
+        llm, prompt, source_documents = self._prepare_answer(question, model, temperature)
+        
+        def answer_stream() -> Iterator[str]:
+            tokens = []
+            for chunk in llm.stream(prompt):
+                tokens.append(chunk.content)
+                yield chunk.content
+            
+            # Remember the exchange once the full answer is known
+            self.memory.save_context({"question": question}, {"answer": "".join(tokens)})
+        
+        return {
+            'answer_stream': answer_stream(),
+            'sources': self._format_sources(source_documents),
+            'confidence': self._calculate_confidence({'source_documents': source_documents})
+        }
+    
+    def _prepare_answer(self, question: str, model: str, temperature: float) -> Tuple[ChatOpenAI, str, List[Document]]:
+        """Retrieve context and build the prompt for a question"""
+        
+        if not self.retriever:
             raise ValueError("Vector store not built yet. Please process documents first.")
         
-        # For now, we'll use the chain as-is without dynamic model switching
-        # to avoid compatibility issues
+        # Documents may have been added by another process since results were cached
+        self.query_cache.sync_version(self._store_version())
         
-        # Get answer
-        result = self.qa_chain({"question": question})
+        llm = self._get_llm(model, temperature)
+        
+        # Follow-up questions ("what about the second one?") are rewritten into a
+        # standalone question first, so retrieval and the answer see the full context
+        if self.memory.chat_memory.messages:
+            # Retrieve for the question as asked while the LLM condenses it. Questions
+            # that are already standalone come back unchanged, and their context is
+            # then ready as soon as the condense call returns.
+            speculative = self._executor.submit(
+                self.retriever.get_relevant_documents, question, k=self._estimate_k(question)
+            )
+            standalone = llm.invoke(CONDENSE_QUESTION_PROMPT.format(
+                chat_history=self._format_chat_history(),
+                question=question
+            )).content.strip()
+            
+            if QueryCache.normalize_question(standalone) == QueryCache.normalize_question(question):
+                source_documents = speculative.result()
+            else:
+                source_documents = self.retriever.get_relevant_documents(standalone, k=self._estimate_k(standalone))
+            question = standalone
+        else:
+            source_documents = self.retriever.get_relevant_documents(question, k=self._estimate_k(question))
+        
+        prompt = self.prompt.format(
+            context="\n\n".join(doc.page_content for doc in source_documents),
+            question=question
+        )
+        return llm, prompt, source_documents
+    
+    def _format_sources(self, source_documents: List[Document]) -> List[str]:
+        """Format source documents for display"""
         
-        # Extract sources
         sources = []
-        for doc in result['source_documents']:
+        for doc in source_documents:
             source_info = f"📄 {doc.metadata.get('source', 'Unknown')} (Chunk {doc.metadata.get('chunk_index', 0)})"
             if doc.page_content:
                 # Get first 150 characters as preview
                 preview = doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
                 source_info += f"\n💭 Preview: {preview}"
             sources.append(source_info)
+        return sources
+    
+    def _estimate_k(self, question: str) -> int:
+        """Estimate how many chunks a question needs"""
+        words = [word.strip("?.,!:;\"'") for word in question.lower().split()]
         
-        return {
-            'answer': result['answer'],
-            'sources': sources,
-            'confidence': self._calculate_confidence(result)
-        }
+        # Broad questions need more context
+        if BROAD_QUESTION_KEYWORDS.intersection(words):
+            return 5
+        
+        # Short factual questions are usually answered by one or two chunks
+        if len(words) < 10:
+            return 2
+        
+        return 3
+    
+    def _format_chat_history(self) -> str:
+        """Format previous turns for the prompt"""
+        lines = []
+        for message in self.memory.chat_memory.messages:
+            speaker = "Customer" if message.type == "human" else "Assistant"
+            lines.append(f"{speaker}: {message.content}")
+        return "\n".join(lines)
     
     def _calculate_confidence(self, result) -> float:
         """Calculate confidence score based on source relevance"""
@@ -114,24 +628,23 @@ Answer:"""
         if not self.vector_store:
             return {'doc_count': 0, 'chunk_count': 0}
         
-        # Get collection info
-        collection = self.vector_store._collection
-        count = collection.count()
+        # Document names come from the documents table rather than a scan of every
+        # stored chunk; build_vector_store keeps them current afterwards
+        if self._known_sources is None:
+            try:
+                self._known_sources = {doc.name for doc in db_manager.get_all_documents()}
+            except Exception:
+                self._known_sources = set()
         
-        # Estimate unique documents
-        unique_sources = set()
-        try:
-            # Get a sample of metadata to count unique sources
-            results = collection.get(limit=min(count, 100))
-            for metadata in results['metadatas']:
-                if metadata and 'source' in metadata:
-                    unique_sources.add(metadata['source'])
-        except:
-            pass
+        # Both stores keep a running count, so this doesn't read the chunks either
+        if VECTOR_STORE_BACKEND == "faiss":
+            chunk_count = self.vector_store.index.ntotal
+        else:
+            chunk_count = self.vector_store._collection.count()
         
         return {
-            'doc_count': len(unique_sources) if unique_sources else 1,
-            'chunk_count': count
+            'doc_count': len(self._known_sources),
+            'chunk_count': chunk_count
         }
     
     def clear_memory(self):
@@ -0,0 +1,35 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from document_processor import DocumentProcessor, LiteralRecursiveTextSplitter
+
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+def random_text(rng: random.Random) -> str:
+    """Text mixing every separator level, with some words too long to fit a chunk"""
+    pieces = []
+    for _ in range(rng.randint(0, 400)):
+        word = "".join(rng.choice("abcdefghij") for _ in range(rng.choice([1, 3, 8, 40, 300])))
+        pieces.append(word + rng.choice(["\n\n", "\n", ". ", " ", " ", " ", ""]))
+    return "".join(pieces)
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(1000, 200), (100, 20), (30, 0)])
+def test_matches_recursive_character_splitter(chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size)
+    literal = LiteralRecursiveTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=SEPARATORS)
+    upstream = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=SEPARATORS)
+    
+    for _ in range(200):
+        text = random_text(rng)
+        assert literal.split_text(text) == upstream.split_text(text)
+
+def test_document_processor_splitter_matches_upstream():
+    rng = random.Random(0)
+    upstream = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, separators=SEPARATORS)
+    processor = DocumentProcessor()
+    
+    for _ in range(20):
+        text = random_text(rng)
+        assert processor.text_splitter.split_text(text) == upstream.split_text(text)